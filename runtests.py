@@ -28,7 +28,7 @@ Test runner for ``clusterpolate`` tests.
 import os.path
 import sys
 
-import nose
+import pytest
 
 
 _ROOT_DIR = os.path.dirname(__file__)
@@ -38,13 +38,9 @@ sys.path.insert(0, _SRC_DIR)
 _HTML_DIR = os.path.join(_ROOT_DIR, 'coverage')
 
 args = [
-        '--with-coverage',
-        '--cover-branches',
-        '--cover-erase',
-        '--cover-package', 'clusterpolate',
-        '--cover-html',
-        '--cover-html-dir', _HTML_DIR,
+        '--cov', 'clusterpolate',
+        '--cov-branch',
+        '--cov-report', 'html:' + _HTML_DIR,
+        os.path.join(_ROOT_DIR, 'tests'),
        ]
-args = [sys.argv[0]] + args + sys.argv[1:]
-nose.main(argv=args)
-
+sys.exit(pytest.main(args + sys.argv[1:]))
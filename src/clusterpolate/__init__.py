@@ -48,21 +48,29 @@ from __future__ import (absolute_import, division, print_function,
                         unicode_literals)
 
 import multiprocessing
-import time
-try:
-    import Queue as queue  # Py2
-except ImportError:
-    import queue  # Py3
+import multiprocessing.pool
+import threading
 
 import numpy as np
 import PIL.Image
-import sklearn.neighbors
+import scipy.spatial
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+try:
+    _string_types = basestring
+except NameError:
+    _string_types = str
 
 
 __version__ = '0.2.0'
 
 
-__all__ = ['bounding_box', 'bump', 'clusterpolate', 'image']
+__all__ = ['bounding_box', 'bump', 'clear_cache', 'clusterpolate',
+           'clusterpolate_grid', 'image', 'tabulate', 'wendland']
 
 
 def bump(r):
@@ -78,89 +86,403 @@ def bump(r):
     n = np.exp(1)
 
     def kernel(dist):
-        result = np.zeros(dist.shape)
-        close = dist < r
-        result[close] = n * np.exp(-1 / (1 - ir2 * dist[close]**2))
+        # Clipping the scaled squared distances at 1 maps all distances
+        # of at least ``r`` to exp(-inf) = 0, so no masking is necessary.
+        # ``asarray`` turns the scalar result for 0-d inputs into an array
+        # that can be modified in place.
+        result = np.asarray(ir2 * np.square(dist), dtype=float)
+        np.minimum(result, 1, out=result)
+        np.subtract(1, result, out=result)
+        with np.errstate(divide='ignore'):
+            np.divide(-1, result, out=result)
+        np.exp(result, out=result)
+        result *= n
         return result
 
     return kernel
 
 
-class _Process(multiprocessing.Process):
+def wendland(r):
     """
-    Process with CTRL+C handling.
+    Factory for Wendland kernel functions.
+
+    ``r`` is the radius of the kernel function.
 
-    Used by internally by ``_map``.
+    The returned kernel function is Wendland's C2 function, a polynomial
+    with compact support that is cheaper to evaluate than
+    :py:func:`bump`. It assumes that all values in the input vector are
+    non-negative.
     """
-    def __init__(self, f, task, args, index, queue):
-        super(_Process, self).__init__()
-        self.index = index
-        self.f = f
-        self.task = task
-        self.args = args
-        self.queue = queue
+    def kernel(dist):
+        # Clipping the scaled distances at 1 maps all distances of at
+        # least ``r`` to 0, so no masking is necessary.
+        u = np.asarray(np.minimum(dist / r, 1), dtype=float)
+        result = 4 * u
+        result += 1
+        np.subtract(1, u, out=u)
+        np.square(u, out=u)
+        np.square(u, out=u)
+        result *= u
+        return result
 
-    def run(self):
-        try:
-            result = self.f(self.task, *self.args)
-            self.queue.put((self.index, result), False)
-        except KeyboardInterrupt:
-            pass  # Handled in caller
+    return kernel
 
 
-def _map(f, tasks, args):
+def tabulate(kernel_factory, size=4096):
     """
-    Multiprocessing map.
+    Factory for tabulated kernel functions.
+
+    ``kernel_factory`` is a kernel factory like :py:func:`bump`. The
+    returned factory creates kernel functions that evaluate the original
+    kernel function once at ``size + 1`` equidistant distances between
+    0 and the radius and use linear interpolation between these values
+    afterwards. This is faster for kernels that are expensive to
+    evaluate, at the cost of a small approximation error.
+    """
+    tables = {}
+
+    def factory(r):
+        if r not in tables:
+            kernel = kernel_factory(r)
+            # The extra zero entry at the end allows interpolation at the
+            # radius itself.
+            tables[r] = np.append(kernel(np.linspace(0, r, size + 1)), 0)
+        table = tables[r]
+        scale = size / r
+
+        def tabulated(dist):
+            frac = np.minimum(dist * scale, size)
+            index = frac.astype(np.intp)
+            frac -= index
+            result = table[index + 1]
+            lower = table[index]
+            result -= lower
+            result *= frac
+            result += lower
+            return result
+
+        return tabulated
+
+    return factory
+
+
+def _map(f, tasks, args, num_jobs=None):
+    """
+    Multithreaded map.
 
     For each element ``task`` in ``tasks``, execute ``f(task, *args)``
-    in a separate process.
+    using a pool of ``num_jobs`` threads (by default, one per CPU). This
+    only pays off if ``f`` releases the GIL for most of its work.
 
     Returns a list of the return values in the correct order.
     """
-    tasks = list(tasks)
-    result_queue = multiprocessing.Queue(len(tasks))
-    processes = []
-    for i, task in enumerate(tasks):
-        process = _Process(f, task, args, i, result_queue)
-        processes.append(process)
-        process.start()
-    running = lambda: any(p.is_alive() for p in processes)
+    num_jobs = min(num_jobs or multiprocessing.cpu_count(), len(tasks))
+    pool = multiprocessing.pool.ThreadPool(num_jobs)
     try:
-        values = []
-        while (len(values) < len(tasks)) and running():
-            try:
-                values.append(result_queue.get(timeout=0.1))
-            except queue.Empty:
-                pass
-        if len(values) < len(tasks):
-            raise RuntimeError('Child process exited abnormally.')
-        values = sorted(values)
-    except KeyboardInterrupt:
-        # Wait until threads have finished before re-raising
-        while running():
-            time.sleep(0.1)
-        raise
-    return [v[1] for v in values]
-
-
-def _worker(targets, neighbors, values, kernel):
+        return pool.map(lambda task: f(task, *args), tasks)
+    finally:
+        pool.terminate()
+
+
+# Number of targets for which neighbors are looked up at once. Bounds
+# the size of the intermediate neighbor arrays and is the unit of work
+# for parallelization.
+_BATCH_SIZE = 4096
+
+
+# Recently used neighbor trees, most recent first. See ``_get_tree``.
+_trees = []
+_trees_lock = threading.Lock()
+
+# Maximum number of cached neighbor trees.
+_MAX_TREES = 8
+
+
+def _get_tree(points):
+    """
+    Get a neighbor tree for the given points.
+
+    The trees for the most recently used sets of points are cached, so
+    that repeated calls for the same data do not rebuild them.
+    """
+    with _trees_lock:
+        for i, tree in enumerate(_trees):
+            if np.array_equal(tree.data, points):
+                del _trees[i]
+                break
+        else:
+            # The tree must not share its data with the caller's
+            # points, which could be modified later on.
+            tree = scipy.spatial.cKDTree(points, copy_data=True)
+            del _trees[_MAX_TREES - 1:]
+        _trees.insert(0, tree)
+    return tree
+
+
+def clear_cache():
+    """
+    Clear the cache of neighbor trees.
+
+    The cached trees keep copies of the points they were built from,
+    see :py:func:`~.clusterpolate`. Call this function to release their
+    memory.
+    """
+    with _trees_lock:
+        del _trees[:]
+
+
+# Maximum number of elements in the scratch arrays used by the
+# brute-force neighbor search, chosen so that they fit into the cache.
+_BRUTE_FORCE_BLOCK_SIZE = 2 ** 15
+
+
+def _brute_force_query(points, targets, radius):
+    """
+    Look up the neighbors of targets by comparing them to all points.
+
+    Returns the neighbor arrays in the same format as ``_radius_query``.
+    """
+    # The targets are processed in blocks that re-use the same scratch
+    # arrays instead of computing all squared distances at once.
+    block = max(1, _BRUTE_FORCE_BLOCK_SIZE // max(1, points.shape[0]))
+    dist2_buffer = np.empty((block, points.shape[0]))
+    diff_buffer = np.empty((block, points.shape[0]))
+    target_inds = []
+    point_inds = []
+    dists = []
+    for start in range(0, targets.shape[0], block):
+        block_targets = targets[start:start + block]
+        dist2 = dist2_buffer[:block_targets.shape[0]]
+        diff = diff_buffer[:block_targets.shape[0]]
+        dist2.fill(0)
+        for k in range(points.shape[1]):
+            np.subtract(block_targets[:, k, None], points[None, :, k],
+                        out=diff)
+            np.square(diff, out=diff)
+            dist2 += diff
+        # Square roots are only computed for the pairs within the radius
+        t, p = np.nonzero(dist2 <= radius * radius)
+        target_inds.append(t + start)
+        point_inds.append(p)
+        dists.append(np.sqrt(dist2[t, p]))
+    return (np.concatenate(target_inds), np.concatenate(dists),
+            np.concatenate(point_inds))
+
+
+def _radius_query(neighbors, targets, radius):
+    """
+    Look up the neighbors of targets.
+
+    ``neighbors`` is either a :py:class:`scipy.spatial.cKDTree`, a tree
+    with a ``query_radius`` method (like
+    :py:class:`sklearn.neighbors.BallTree`), a fitted instance of
+    :py:class:`sklearn.neighbors.NearestNeighbors` or the array of
+    points for a brute-force search.
+
+    Returns three flat arrays describing all pairs of targets and
+    neighboring points: The indices of the targets, the distances and
+    the indices of the points. The pairs are in no particular order.
+    """
+    if isinstance(neighbors, np.ndarray):
+        return _brute_force_query(neighbors, targets, radius)
+    if hasattr(neighbors, 'sparse_distance_matrix'):
+        # Querying the points' tree with a tree of the targets yields
+        # flat arrays directly instead of one list per target.
+        pairs = scipy.spatial.cKDTree(targets).sparse_distance_matrix(
+            neighbors, radius, output_type='ndarray')
+        return pairs['i'], pairs['v'], pairs['j']
+    if hasattr(neighbors, 'query_radius'):
+        inds, dists = neighbors.query_radius(targets, r=radius,
+                                             return_distance=True)
+    else:
+        dists, inds = neighbors.radius_neighbors(targets)
+    counts = np.fromiter(map(len, dists), dtype=np.intp, count=len(dists))
+    return (np.repeat(np.arange(len(dists)), counts), np.concatenate(dists),
+            np.concatenate(inds))
+
+
+def _reduce_pairs(weights, target_inds, inds, values, weights_sum,
+                  predictions, membership):
+    """
+    Accumulate neighbor weights per target in a single pass.
+
+    The pairs may be in any order. ``weights_sum``, ``predictions`` and
+    ``membership`` must be zero-initialized. Compiled using Numba if it
+    is available. Membership degrees are only computed if
+    ``membership`` is not empty.
+    """
+    compute_membership = membership.shape[0] > 0
+    for k in range(weights.shape[0]):
+        i = target_inds[k]
+        w = weights[k]
+        weights_sum[i] += w
+        predictions[i] += w * values[inds[k]]
+        if compute_membership and w > membership[i]:
+            membership[i] = w
+    for i in range(predictions.shape[0]):
+        if weights_sum[i] > 0:
+            predictions[i] /= weights_sum[i]
+
+
+if numba is not None:
+    # Compile eagerly for the argument types used by ``_reduce``
+    _reduce_pairs = numba.njit(
+        'void(float64[:], intp[:], intp[:], float64[:], float64[:], '
+        'float64[:], float64[:])', nogil=True, cache=True)(_reduce_pairs)
+
+# Placeholder for ``_reduce_pairs`` if no membership is requested
+_NO_MEMBERSHIP = np.empty(0)
+
+
+def _reduce(target_inds, dists, inds, values, kernel, predictions,
+            membership):
+    """
+    Compute predictions and membership degrees from neighbor arrays.
+
+    See ``_radius_query`` for the format of the neighbor arrays. The
+    results are written to the zero-initialized arrays ``predictions``
+    and ``membership``. If ``membership`` is ``None`` then the membership
+    degrees are not computed.
+    """
+    weights = np.asarray(kernel(dists), dtype=np.float64)
+    if numba is not None:
+        _reduce_pairs(weights, target_inds.astype(np.intp, copy=False),
+                      inds.astype(np.intp, copy=False), values,
+                      np.zeros(predictions.shape[0]), predictions,
+                      _NO_MEMBERSHIP if membership is None else membership)
+        return
+
+    # ``bincount`` sums the weights per target without requiring the
+    # pairs to be grouped by target.
+    n = predictions.shape[0]
+    weights_sum = np.bincount(target_inds, weights, minlength=n)
+    weighted_values = np.bincount(target_inds, weights * values[inds],
+                                  minlength=n)
+    valid = weights_sum > 0
+    predictions[valid] = weighted_values[valid] / weights_sum[valid]
+    if membership is None:
+        return
+
+    # ``np.maximum.at`` is slow on older NumPy versions. Instead, the
+    # pairs are grouped by target (only the tree search returns them in
+    # arbitrary order) and the non-empty segments are reduced.
+    if np.any(target_inds[1:] < target_inds[:-1]):
+        keys = target_inds
+        if n <= np.iinfo(np.int16).max:
+            # Stable sorting uses radix sort for 16-bit integers
+            keys = keys.astype(np.int16)
+        weights = weights[np.argsort(keys, kind='mergesort')]
+    counts = np.bincount(target_inds, minlength=n)
+    nonempty = np.flatnonzero(counts)
+    if nonempty.size:
+        offsets = (np.cumsum(counts) - counts)[nonempty]
+        membership[nonempty] = np.maximum.reduceat(weights, offsets)
+
+
+def _worker(batch, targets, neighbors, values, kernel, radius, predictions,
+            membership):
     """
     Internal worker for parallelizing ``clusterpolate``.
+
+    Processes the targets in the slice ``batch``.
     """
-    dists, inds = neighbors.radius_neighbors(targets)
-    predictions = np.zeros(targets.shape[0])
-    membership = np.zeros(targets.shape[0])
-    for i, (dist, ind) in enumerate(zip(dists, inds)):
-        weights = kernel(dist)
-        weights_sum = np.sum(weights)
-        if weights_sum > 0:
-            predictions[i] = np.sum(weights * values[ind]) / weights_sum
-            membership[i] = weights.max()
-    return predictions, membership
+    target_inds, dists, inds = _radius_query(neighbors, targets[batch],
+                                             radius)
+    if membership is not None:
+        membership = membership[batch]
+    _reduce(target_inds, dists, inds, values, kernel, predictions[batch],
+            membership)
+
+
+def _grid(x, y):
+    """
+    Create the points of a rectangular grid.
+
+    ``x`` and ``y`` are the coordinates of the grid's columns and rows.
+
+    Returns an array of shape ``(len(x) * len(y), 2)`` which contains
+    the grid points row by row.
+    """
+    grid = np.empty((len(x) * len(y), 2))
+    grid[:, 0] = np.tile(x, len(y))
+    grid[:, 1] = np.repeat(y, len(x))
+    return grid
+
+
+def _grid_worker(rows, x, y, neighbors, values, kernel, radius, predictions,
+                 membership):
+    """
+    Internal worker for parallelizing ``clusterpolate_grid``.
+
+    Processes the grid rows in the slice ``rows``.
+    """
+    target_inds, dists, inds = _radius_query(neighbors, _grid(x, y[rows]),
+                                             radius)
+    if membership is not None:
+        membership = membership[rows].reshape(-1)
+    _reduce(target_inds, dists, inds, values, kernel,
+            predictions[rows].reshape(-1), membership)
+
+
+# Maximum number of point/target pairs for which brute-force search is
+# used by default, since it is faster than building and querying a
+# tree for small inputs.
+_BRUTE_FORCE_MAX_PAIRS = 2 ** 14
+
+
+def _prepare(points, values, num_targets, radius, kernel_factory,
+             neighbors):
+    """
+    Prepare the data, the neighbor lookup and the kernel.
+    """
+    # Accept lists as inputs. Arrays that already have the right layout
+    # are not copied.
+    points = np.ascontiguousarray(points, dtype=np.float64)
+    values = np.ascontiguousarray(values, dtype=np.float64)
+    if points.shape[0] != values.shape[0]:
+        raise ValueError('The numbers of points and values must match.')
+
+    if neighbors is None:
+        if points.shape[0] * num_targets <= _BRUTE_FORCE_MAX_PAIRS:
+            neighbors = points
+        else:
+            neighbors = _get_tree(points)
+    elif isinstance(neighbors, _string_types) and neighbors == 'brute':
+        neighbors = points
+    elif hasattr(neighbors, 'fit'):
+        neighbors.fit(points)
+    return values, neighbors, kernel_factory(radius)
+
+
+def _outputs(shape, out, return_membership):
+    """
+    Prepare the arrays for the predictions and membership degrees.
+
+    ``out`` is either ``None`` or a user-supplied pair of arrays which
+    is validated and reset. If ``return_membership`` is false then
+    ``None`` is returned instead of the membership array.
+    """
+    if out is None:
+        out = (None, None)
+    arrays = []
+    for array, needed in zip(out, (True, return_membership)):
+        if not needed:
+            array = None
+        elif array is None:
+            array = np.zeros(shape)
+        else:
+            if (array.shape != shape or array.dtype != np.float64 or
+                    not array.flags.c_contiguous):
+                raise ValueError('Output arrays must be C-contiguous ' +
+                                 'float64 arrays of shape %s.' % (shape,))
+            array.fill(0)
+        arrays.append(array)
+    return arrays
 
 
 def clusterpolate(points, values, targets, radius=1, kernel_factory=bump,
-                  neighbors=None, num_jobs=None):
+                  neighbors=None, num_jobs=None, out=None,
+                  return_membership=True):
     """
     Clusterpolate data.
 
@@ -177,39 +499,97 @@ def clusterpolate(points, values, targets, radius=1, kernel_factory=bump,
     must yield a value of 1) and it should be zero for distances greater
     than ``radius``.
 
-    Neighbor lookup is done using an instance of
-    :py:class:`sklearn.neighbors.NearestNeighbors`, constructed with
-    the default options. You can pass an instance that is configured
-    to suit your data via the ``neighbors`` parameter.
+    Neighbor lookup is done using a :py:class:`scipy.spatial.cKDTree`
+    that is built from ``points`` using the default options. The trees
+    for the 8 most recently used ``points`` are cached and re-used. Each
+    cached tree keeps a copy of its points in memory until it is evicted
+    or :py:func:`~.clear_cache` is called.
+
+    You can pass a tree that is configured to suit your data via the
+    ``neighbors`` parameter. It must already be built from ``points``.
+    Besides :py:class:`~scipy.spatial.cKDTree`, the trees from
+    :py:mod:`sklearn.neighbors` (like
+    :py:class:`~sklearn.neighbors.BallTree`) are supported. Finally,
+    ``neighbors`` can be an instance of
+    :py:class:`sklearn.neighbors.NearestNeighbors`, which is fitted to
+    ``points`` and queried using its own radius.
+
+    If ``neighbors`` is ``'brute'`` then no tree is used. Instead, each
+    target is compared with all points using vectorized array
+    operations. This is faster if there are only few points. Brute-force
+    search is also used by default if there are only few points and
+    targets.
 
     By default, computations are parallelized according to the number
     of available CPUs. Set ``num_jobs`` to a specific number to use
-    more or fewer parallel processes.
+    more or fewer parallel threads.
 
     Returns two arrays. The first contains the predicted value for the
     corresponding target point, and the second contains the target
-    point's degree of membership (a float between 0 and 1).
+    point's degree of membership (a float between 0 and 1). By default,
+    new arrays are allocated. You can pass a 2-tuple of C-contiguous
+    float64 arrays of the right shape via ``out`` to re-use them
+    instead.
+
+    If ``return_membership`` is false then the membership degrees are
+    not computed and ``None`` is returned in their place. This saves
+    some time if only the predictions are needed.
     """
-    # Accept lists as inputs
-    points = np.array(points)
-    values = np.array(values)
-    if points.shape[0] != values.shape[0]:
-        raise ValueError('The numbers of points and values must match.')
-    targets = np.array(targets)
+    targets = np.ascontiguousarray(targets, dtype=np.float64)
+    values, neighbors, kernel = _prepare(points, values, targets.shape[0],
+                                         radius, kernel_factory, neighbors)
+    predictions, membership = _outputs((targets.shape[0],), out,
+                                       return_membership)
+    tasks = [slice(start, start + _BATCH_SIZE)
+             for start in range(0, targets.shape[0], _BATCH_SIZE)]
+    _map(_worker, tasks, (targets, neighbors, values, kernel, radius,
+                          predictions, membership), num_jobs)
+    return predictions, membership
 
-    if neighbors is None:
-        neighbors = sklearn.neighbors.NearestNeighbors(radius=radius)
-    neighbors.fit(points)
-    kernel = kernel_factory(radius)
-
-    num_jobs = min(num_jobs or multiprocessing.cpu_count(), targets.shape[0])
-    tasks = np.array_split(targets, num_jobs)
-    values = _map(_worker, tasks, (neighbors, values, kernel))
-    predictions = np.concatenate([v[0] for v in values])
-    membership = np.concatenate([v[1] for v in values])
+
+def clusterpolate_grid(points, values, x, y, radius=1, kernel_factory=bump,
+                       neighbors=None, num_jobs=None, out=None,
+                       return_membership=True):
+    """
+    Clusterpolate data on a rectangular grid.
+
+    ``x`` and ``y`` (array-like) are the coordinates of the grid's
+    columns and rows. The other arguments are the same as for
+    :py:func:`~.clusterpolate`.
+
+    This is equivalent to calling :py:func:`~.clusterpolate` with all
+    grid points as targets, but the grid points are only created for a
+    few rows at a time instead of all at once.
+
+    Returns two arrays of shape ``(len(y), len(x))`` containing the
+    predicted values and the degrees of membership of the grid points
+    (or ``None`` if ``return_membership`` is false).
+    """
+    x = np.ascontiguousarray(x, dtype=np.float64)
+    y = np.ascontiguousarray(y, dtype=np.float64)
+    values, neighbors, kernel = _prepare(points, values, len(x) * len(y),
+                                         radius, kernel_factory, neighbors)
+    predictions, membership = _outputs((len(y), len(x)), out,
+                                       return_membership)
+    num_rows = max(1, _BATCH_SIZE // len(x))
+    tasks = [slice(start, start + num_rows)
+             for start in range(0, len(y), num_rows)]
+    _map(_grid_worker, tasks, (x, y, neighbors, values, kernel, radius,
+                               predictions, membership), num_jobs)
     return predictions, membership
 
 
+def _to_bytes(data, out):
+    """
+    Convert values between 0 and 1 to bytes.
+
+    The bytes are stored in the array ``out``. ``data`` is modified in
+    place.
+    """
+    data *= 255
+    out[...] = data
+
+
 def image(points, values, size, area=None, normalize=True, colormap=None,
           **kwargs):
     """
@@ -232,11 +612,15 @@ def image(points, values, size, area=None, normalize=True, colormap=None,
     clusterpolated values. It should accept values in a 2D array and
     return the corresponding colors in an array of the same shape but
     with an extra dimension containing the RGB components (between 0 and
-    1). The colormaps from :py:mod:`matplotlib.cm` are a good choice. If
-    no colormap is given then a grayscale image is generated.
+    1). If it accepts a ``bytes`` keyword argument then it is called
+    with ``bytes=True`` and may return 8-bit colors instead. The
+    colormaps from :py:mod:`matplotlib.cm` are a good choice. If no
+    colormap is given then a grayscale image is generated.
 
     Any additional keyword-argument is passed on to
-    :py:func:`~.clusterpolate`.
+    :py:func:`~.clusterpolate_grid`. The membership degrees are used as
+    the image's alpha channel. If ``return_membership`` is false then
+    they are not computed and an opaque image is generated instead.
 
     This function returns 4 values: The first 3 are arrays containing
     the pixel coordinates, the clusterpolated values, and the membership
@@ -251,31 +635,42 @@ def image(points, values, size, area=None, normalize=True, colormap=None,
         area = bounding_box(points)
     x = np.linspace(area[0][0], area[1][0], size[0])
     y = np.linspace(area[0][1], area[1][1], size[1])
-    targets = np.vstack(np.meshgrid(x, y)).reshape(2, -1).T
-
-    predictions, memberships = clusterpolate(points, values, targets, **kwargs)
-
-    targets = targets.reshape(size + (-1,))
-    predictions = predictions.reshape(size[::-1])
-    memberships = memberships.reshape(size[::-1])
+    predictions, memberships = clusterpolate_grid(points, values, x, y,
+                                                  **kwargs)
+    targets = _grid(x, y).reshape(size + (-1,))
 
+    # Single precision is sufficient for the 8-bit image data. The
+    # conversion is done in place to avoid temporary arrays.
+    normalized = predictions.astype(np.float32)
     if normalize:
-        pmin = predictions.min()
-        pmax = predictions.max()
-        normalized = (predictions - pmin) / (pmax - pmin)
-    else:
-        normalized = predictions
+        pmin = normalized.min()
+        pmax = normalized.max()
+        normalized -= pmin
+        normalized *= 1 / (pmax - pmin)
+
+    # Assemble all bands in a single array so that only one conversion
+    # to PIL is necessary.
+    mode = 'L' if colormap is None else 'RGB'
+    if memberships is not None:
+        mode += 'A'
+    pixels = np.empty(predictions.shape + (len(mode),), dtype=np.uint8)
     if colormap is None:
-        bands = (PIL.Image.fromarray(np.uint8(255 * normalized)),)
-        mode = 'LA'
+        _to_bytes(normalized, pixels[..., 0])
     else:
-        rgba = PIL.Image.fromarray(np.uint8(255 * colormap(normalized)))
-        bands = rgba.split()[:3]
-        mode = 'RGBA'
-    alpha = PIL.Image.fromarray(np.uint8(255 * memberships))
-    bands += (alpha,)
-    img = PIL.Image.merge(mode, bands)
-    return targets, predictions.T, memberships.T, img
+        try:
+            # Matplotlib's colormaps can produce 8-bit colors directly
+            colors = colormap(normalized, bytes=True)
+        except TypeError:
+            colors = colormap(normalized)
+        if colors.dtype == np.uint8:
+            pixels[..., :3] = colors[..., :3]
+        else:
+            _to_bytes(colors[..., :3], pixels[..., :3])
+    if memberships is not None:
+        _to_bytes(memberships.astype(np.float32), pixels[..., -1])
+        memberships = memberships.T
+    img = PIL.Image.frombuffer(mode, size, pixels, 'raw', mode, 0, 1)
+    return targets, predictions.T, memberships, img
 
 
 def bounding_box(points):
@@ -287,6 +682,8 @@ def bounding_box(points):
     The return value is a 2x2 tuple containing the upper left and the
     lower right bounding box corners.
     """
-    p = np.array(points)
-    return ((p[:, 0].min(), p[:, 1].min()), (p[:, 0].max(), p[:, 1].max()))
+    p = np.asarray(points)
+    lower = p.min(axis=0)
+    upper = p.max(axis=0)
+    return ((lower[0], lower[1]), (upper[0], upper[1]))
 
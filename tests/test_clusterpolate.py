@@ -29,7 +29,7 @@ import math
 
 from matplotlib.cm import summer
 import numpy as np
-from nose.tools import eq_ as eq, ok_ as ok, raises
+import pytest
 
 import clusterpolate as cp
 
@@ -39,23 +39,209 @@ points = [(0, 0), (1, 0), (1.5, 0)]
 values = np.array([1, 2, 3])
 
 
+def random_data(n_points, n_targets):
+    rng = np.random.RandomState(0)
+    return rng.rand(n_points, 2), rng.rand(n_points), rng.rand(n_targets, 2)
+
+
 def test_clusterpolate():
     targets = np.array([(0, 0), (1.0, 0), (1.5, 0)])
     pred, member = cp.clusterpolate(points, values, targets, radius=1)
-    eq(pred.shape, (3,))
-    eq(member.shape, (3,))
-    ok(pred.min() >= values.min())
-    ok(pred.max() <= values.max())
-    ok(member.min() >= 0)
-    ok(member.max() <= 1)
+    assert pred.shape == (3,)
+    assert member.shape == (3,)
+    assert pred.min() >= values.min()
+    assert pred.max() <= values.max()
+    assert member.min() >= 0
+    assert member.max() <= 1
+
+
+@pytest.mark.parametrize('n_points,n_targets,radius', [(1000, 1000, 0.1),
+                                                       (10000, 1000, 0.05)])
+def test_clusterpolate_random(n_points, n_targets, radius):
+    p, v, targets = random_data(n_points, n_targets)
+    pred, member = cp.clusterpolate(p, v, targets, radius=radius)
+    assert pred.shape == (n_targets,)
+    assert member.shape == (n_targets,)
+    # Targets without any points in range have a prediction of zero
+    inside = member > 0
+    assert pred[inside].min() >= v.min()
+    assert pred[inside].max() <= v.max()
+    assert np.all(pred[~inside] == 0)
+    assert member.min() >= 0
+    assert member.max() <= 1
+
+
+def reference(p, v, targets, radius):
+    """
+    Dense reference implementation of clusterpolation.
+    """
+    dist = np.sqrt(((targets[:, None, :] - p[None, :, :]) ** 2).sum(axis=2))
+    weights = cp.bump(radius)(dist)
+    weights_sum = weights.sum(axis=1)
+    pred = np.zeros(len(targets))
+    inside = weights_sum > 0
+    pred[inside] = weights[inside].dot(v) / weights_sum[inside]
+    return pred, weights.max(axis=1)
+
+
+@pytest.mark.parametrize('use_numba', [True, False])
+def test_clusterpolate_brute_force(use_numba, monkeypatch):
+    if not use_numba:
+        monkeypatch.setattr(cp, 'numba', None)
+    p, v, targets = random_data(200, 5000)
+    targets = targets * 1.2 - 0.1
+    pred, member = cp.clusterpolate(p, v, targets, radius=0.1)
+    expected_pred, expected_member = reference(p, v, targets, 0.1)
+    assert np.allclose(pred, expected_pred)
+    assert np.all(pred[expected_member == 0] == 0)
+    assert np.allclose(member, expected_member)
+
+
+def test_clusterpolate_brute_force_blocks():
+    # Enough points for the brute-force search to use many small blocks,
+    # the last of which is only partially filled
+    p, v, targets = random_data(2000, 2010)
+    pred, member = cp.clusterpolate(p, v, targets, radius=0.05,
+                                    neighbors='brute')
+    expected_pred, expected_member = cp.clusterpolate(p, v, targets,
+                                                      radius=0.05)
+    assert np.allclose(pred, expected_pred)
+    assert np.allclose(member, expected_member)
+    expected_pred, expected_member = reference(p, v, targets, 0.05)
+    assert np.allclose(pred, expected_pred)
+    assert np.allclose(member, expected_member)
+
+
+def test_clusterpolate_neighbors_array():
+    # Arrays must not be compared with the ``'brute'`` option
+    targets = np.array([(0, 0), (1.0, 0), (1.5, 0)])
+    pred, member = cp.clusterpolate(points, values, targets,
+                                    neighbors=np.array(points, dtype=float))
+    expected_pred, expected_member = cp.clusterpolate(points, values, targets)
+    assert np.allclose(pred, expected_pred)
+    assert np.allclose(member, expected_member)
+
+
+def test_tree_cache():
+    cp.clear_cache()
+    p, v, targets = random_data(200, 1000)
+    pred = cp.clusterpolate(p, v, targets, radius=0.1)[0]
+    tree = cp._trees[0]
+    cp.clusterpolate(p, v, targets, radius=0.1)
+    assert cp._trees == [tree]
+
+    # The cached tree must not be affected by changes to the points
+    p[:100] += 0.05
+    changed = cp.clusterpolate(p, v, targets, radius=0.1)[0]
+    assert not np.allclose(pred, changed)
+    assert np.allclose(changed, reference(p, v, targets, 0.1)[0])
+    assert len(cp._trees) == 2
+
+    for i in range(cp._MAX_TREES):
+        cp.clusterpolate(p + i + 1, v, targets, radius=0.1)
+    assert len(cp._trees) == cp._MAX_TREES
+    assert tree not in cp._trees
+    cp.clear_cache()
+    assert not cp._trees
+
 
+def test_clusterpolate_sklearn():
+    neighbors = pytest.importorskip('sklearn.neighbors')
+    p, v, targets = random_data(200, 1000)
+    expected_pred, expected_member = reference(p, v, targets, 0.1)
+    for n in [neighbors.BallTree(p), neighbors.NearestNeighbors(radius=0.1)]:
+        pred, member = cp.clusterpolate(p, v, targets, radius=0.1,
+                                        neighbors=n)
+        assert np.allclose(pred, expected_pred)
+        assert np.allclose(member, expected_member)
 
-def test_image():
-    size = (3, 2)
+
+def test_clusterpolate_out():
+    targets = np.array([(0, 0), (1.0, 0), (1.5, 0)])
+    out = (np.ones(3), np.ones(3))
+    pred, member = cp.clusterpolate(points, values, targets, out=out)
+    assert pred is out[0]
+    assert member is out[1]
+    expected_pred, expected_member = cp.clusterpolate(points, values, targets)
+    assert np.allclose(pred, expected_pred)
+    assert np.allclose(member, expected_member)
+
+
+def test_clusterpolate_no_membership():
+    targets = np.array([(0, 0), (1.0, 0), (1.5, 0)])
+    pred, member = cp.clusterpolate(points, values, targets,
+                                    return_membership=False)
+    assert member is None
+    assert np.allclose(pred, cp.clusterpolate(points, values, targets)[0])
+    img = cp.image(points, values, (3, 2), return_membership=False)[3]
+    assert img.mode == 'L'
+
+
+def test_clusterpolate_out_wrong_shape():
+    with pytest.raises(ValueError):
+        cp.clusterpolate(points, values, [(0, 0)],
+                         out=(np.ones(2), np.ones(2)))
+
+
+@pytest.mark.parametrize('size', [(3, 2), (64, 64), (512, 512)])
+def test_image(size):
     targets, pred, member, img = cp.image(points, values, size,
                                           ((0, 0.5), (2, -0.5)),
                                           colormap=summer)
-    eq(targets.shape, size + (2,))
-    eq(pred.shape, size)
-    eq(member.shape, size)
+    assert targets.shape == size + (2,)
+    assert pred.shape == size
+    assert member.shape == size
+    assert img.size == size
+    assert img.mode == 'RGBA'
+
+
+def test_image_float_colormap():
+    # A colormap that accepts but ignores ``bytes``
+    def colormap(a, **kwargs):
+        return np.dstack([a, a, a, np.ones_like(a)])
+    area = ((0, 0.5), (2, -0.5))
+    rgb = np.asarray(cp.image(points, values, (3, 2), area,
+                              colormap=colormap)[3])
+    gray = np.asarray(cp.image(points, values, (3, 2), area)[3])
+    assert np.array_equal(rgb[..., 0], gray[..., 0])
+    assert np.array_equal(rgb[..., 3], gray[..., 1])
+    assert rgb[..., :3].max() == 255
+
+
+def test_bump():
+    dist = np.array([0, 0.5, 1, 1.5, 2, 3])
+    kernel = cp.bump(2)
+    result = kernel(dist)
+    inside = dist < 2
+    expected = np.exp(1 - 1 / (1 - (dist[inside] / 2) ** 2))
+    assert np.allclose(result[inside], expected)
+    assert result[0] == pytest.approx(1)
+    assert np.all(result[~inside] == 0)
+    assert kernel(np.array(1.0)) == pytest.approx(expected[2])
+    assert cp.bump(1)(np.array(0.5)) == pytest.approx(0.7165, abs=1e-4)
+
+
+def test_tabulate():
+    dist = np.linspace(0, 2, 1001)
+    assert np.allclose(cp.tabulate(cp.bump)(1.5)(dist), cp.bump(1.5)(dist),
+                       atol=1e-5)
+
+
+def test_clusterpolate_grid():
+    x = np.linspace(-0.5, 2, 5)
+    y = np.linspace(-0.5, 0.5, 3)
+    pred, member = cp.clusterpolate_grid(points, values, x, y)
+    assert pred.shape == (3, 5)
+    assert member.shape == (3, 5)
+    targets = [(xi, yi) for yi in y for xi in x]
+    expected_pred, expected_member = cp.clusterpolate(points, values, targets)
+    assert np.allclose(pred.ravel(), expected_pred)
+    assert np.allclose(member.ravel(), expected_member)
+
 
+def test_wendland():
+    dist = np.array([0, 0.5, 1, 2])
+    u = dist / 2.0
+    assert np.allclose(cp.wendland(2)(dist), (1 - u)**4 * (4 * u + 1))
+    assert cp.wendland(1)(dist).tolist() == [1, (0.5**4) * 3, 0, 0]
+    assert cp.wendland(1)(np.array(0.5)) == (0.5**4) * 3